@@ -1,6 +1,13 @@
 from actionlib import SimpleActionClient
 import rospy
 
+from actionlib_msgs.msg import GoalStatus
+
+from collections import OrderedDict
+
+_DONE_STATES = frozenset((GoalStatus.PREEMPTED, GoalStatus.SUCCEEDED, GoalStatus.ABORTED, GoalStatus.REJECTED, GoalStatus.RECALLED))
+
+
 class MultiGoalActionClient:
     def __init__(self, action_server_name, action_type):
         self.action_server_name = action_server_name
@@ -8,7 +15,8 @@ class MultiGoalActionClient:
         # Create a single action client
         self.main_client = SimpleActionClient(self.action_server_name, self.action_type)
         self.action_client = self.main_client.action_client
-        self.action_clients = []
+        # action clients keyed by their id(), in the order the goals were sent
+        self.action_clients = OrderedDict()
 
         # Start a timer to remove all done action clients every 10 seconds
         rospy.Timer(rospy.Duration(10.0), self.remove_all_done_action_clients)
@@ -21,52 +29,58 @@ class MultiGoalActionClient:
         # Create a new action client using self.action_server_name and self.action_type
         action_client = SimpleActionClient(self.action_server_name, self.action_type)
 
-        # Store the new action client instance
-        self.action_clients.append(action_client)
+        # Store the new action client instance before sending, the goal callbacks may fire right away
+        self.action_clients[id(action_client)] = action_client
 
         # Send the goal
-        action_client.send_goal(goal, done_cb=done_cb, active_cb=active_cb, feedback_cb=feedback_cb)
+        try:
+            action_client.send_goal(goal, done_cb=done_cb, active_cb=active_cb, feedback_cb=feedback_cb)
+        except Exception:
+            self.action_clients.pop(id(action_client), None)
+            raise
 
     def cancel_all_goals(self):
-        for client in self.action_clients:
+        # The timer thread and send_goal may change the clients while we iterate
+        for client in list(self.action_clients.values()):
             client.cancel_all_goals()
 
     def wait_for_result(self):
-        return self.action_clients[-1].wait_for_result()
+        return self._last_action_client().wait_for_result()
     
     def get_result(self):
-        result = self.action_clients[-1].get_result()
-        self.remove_action_client(self.action_clients[-1])
+        client = self._last_action_client()
+        result = client.get_result()
+        self.remove_action_client(client)
         return result
     
     def get_goal_state(self):
-        return self.action_clients[-1].get_state()
+        return self._last_action_client().get_state()
     
     def get_goal_status_text(self):
-        return self.action_clients[-1].get_goal_status_text()
+        return self._last_action_client().get_goal_status_text()
     
     def get_goal_id(self):
-        return self.action_clients[-1].get_goal_id()
+        return self._last_action_client().get_goal_id()
     
     def get_num_goals(self):
         return len(self.action_clients)
+
+    def _last_action_client(self):
+        try:
+            return self.action_clients[next(reversed(self.action_clients))]
+        except StopIteration:
+            raise IndexError("MultiGoalActionClient has no goals")
     
     def remove_action_client(self, client):
-        self.action_clients.remove(client)
+        del self.action_clients[id(client)]
 
     def remove_all_done_action_clients(self, event=None):
-        clients_to_remove = []
-        for client in self.action_clients:
-            # 3: DONE, 4: ACTIVE, 5: WAITING_FOR_RESULT, 8: RECALLED
-            if client.get_state() in [3, 4, 5, 8]:
-                clients_to_remove.append(client)
-
-        # We do this because we appeded newer clients to the end
-        clients_to_remove.reverse()
-
-        # Remove all clients that are done except the last one
-        while len(clients_to_remove) > 1:
-            self.remove_action_client(clients_to_remove.pop())
+        # This runs on a timer thread, so work on a snapshot of the clients
+        done_ids = [client_id for client_id, client in list(self.action_clients.items()) if client.get_state() in _DONE_STATES]
+
+        # Remove all clients that are done except the last one, newer clients are appended to the end
+        for client_id in done_ids[:-1]:
+            self.action_clients.pop(client_id, None)
 
     def __getattr__(self, name):
         return getattr(self.main_client, name)
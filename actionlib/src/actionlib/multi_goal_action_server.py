@@ -2,6 +2,8 @@ import rospy
 import threading
 import traceback
 
+from concurrent.futures import ThreadPoolExecutor
+
 from actionlib_msgs.msg import GoalStatus
 
 from actionlib import ActionServer
@@ -9,6 +11,9 @@ from actionlib.server_goal_handle import ServerGoalHandle
 
 from collections import deque
 
+_ACTIVE_STATES = frozenset((GoalStatus.ACTIVE, GoalStatus.PREEMPTING))
+
+
 def nop_cb(goal_handle):
     pass
 
@@ -23,6 +28,10 @@ def nop_cb(goal_handle):
 ## than or equal to the stamp associated with the preempt, accepting a new
 ## goal implies successful preemption of any old goal and the status of the
 ## old goal will be change automatically to reflect this.
+## When constructed with max_parallel_goals greater than one, the server
+## instead runs up to that many goals concurrently, each in its own worker
+## thread; goals are then executed in the order they were received, do not
+## preempt each other, and finishing one goal does not affect the queued ones.
 class MultiGoalActionServer:
     ## @brief Constructor for a MultiGoalActionServer
     ## @param name A name for the action server
@@ -30,11 +39,18 @@ class MultiGoalActionServer:
     ## a new goal is received, allowing users to have blocking callbacks.
     ## Adding an execute callback also deactivates the goalCallback.
     ## @param  auto_start A boolean value that tells the ActionServer wheteher or not to start publishing as soon as it comes up. THIS SHOULD ALWAYS BE SET TO FALSE TO AVOID RACE CONDITIONS and start() should be called after construction of the server.
-    def __init__(self, name, ActionSpec, execute_cb=None, auto_start=True):
-
-        self.new_goal = False
-        self.preempt_request = False
-        self.new_goal_preempt_request = False
+    ## @param max_queue_size The maximum number of goals waiting in the execution queue, further goals are rejected until it drains.
+    ## None makes the queue unbounded.
+    ## @param max_parallel_goals The maximum number of goals the execute callback is run for concurrently.
+    ## With a value greater than one every goal is executed in its own worker thread and the goal
+    ## accessors (set_succeeded, publish_feedback, is_preempt_requested, ...) refer to the goal of the calling thread.
+    def __init__(self, name, ActionSpec, execute_cb=None, auto_start=True, max_queue_size=64, max_parallel_goals=1):
+
+        # these flags are read from the execute thread without locking, so
+        # they are kept in events rather than plain bools guarded by self._state_lock
+        self._new_goal_event = threading.Event()
+        self._preempt_event = threading.Event()
+        self._new_goal_preempt_event = threading.Event()
 
         self.execute_callback = execute_cb
         self.goal_callback = None
@@ -43,37 +59,96 @@ class MultiGoalActionServer:
         self.need_to_terminate = False
         self.terminate_mutex = threading.RLock()
 
-        self.execution_queue = deque()
-
-        # since the internal_goal/preempt_callbacks are invoked from the
-        # ActionServer while holding the self.action_server.lock
-        # self.lock must always be locked after the action server lock
-        # to avoid an inconsistent lock acquisition order
-        self.lock = threading.RLock()
-
-        self.execute_condition = threading.Condition(self.lock)
+        self.max_queue_size = max_queue_size
+        self.execution_queue = deque(maxlen=self.max_queue_size)
 
         self.current_goal = ServerGoalHandle()
         self.next_goal = ServerGoalHandle()
 
+        # goals being executed by the worker threads in parallel mode, keyed by thread ident,
+        # and the ids of those goals for which a preempt has been requested
+        self.max_parallel_goals = max_parallel_goals
+        self.current_goal_by_thread = {}
+        self._preempted_goal_ids = set()
+
+        # stamps of the current and next goal in nanoseconds, None while there is no such goal
+        self._current_stamp_ns = None
+        self._next_stamp_ns = None
+
+        # create the action server, it is only started once our own state is set up
+        self.action_server = ActionServer(name, ActionSpec, self.internal_goal_callback, self.internal_preempt_callback, False)
+
+        # the internal_goal/preempt_callbacks are invoked from the ActionServer
+        # while holding self.action_server.lock, and the goal handles take it
+        # again on every status change, so all of our goal state is guarded by
+        # that same reentrant lock instead of a second one nested inside it
+        self._state_lock = self.action_server.lock
+        # kept for compatibility with code that used the former separate lock
+        self.lock = self._state_lock
+
+        self.execute_condition = threading.Condition(self._state_lock)
+
+        self.execute_thread = None
+        self._executor = None
         if self.execute_callback:
-            self.execute_thread = threading.Thread(None, self.executeLoop)
-            self.execute_thread.start()
-        else:
-            self.execute_thread = None
+            if self.max_parallel_goals > 1:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_parallel_goals)
+            else:
+                self.execute_thread = threading.Thread(None, self.executeLoop)
+                self.execute_thread.start()
 
-        # create the action server
-        self.action_server = ActionServer(name, ActionSpec, self.internal_goal_callback, self.internal_preempt_callback, auto_start)
+        if auto_start:
+            rospy.logwarn("You've passed in true for auto_start to the python action server, you should always pass "
+                          "in false to avoid race conditions.")
+            self.action_server.start()
 
 
     def __del__(self):
-        if hasattr(self, 'execute_callback') and self.execute_callback:
+        if getattr(self, '_executor', None):
+            self._executor.shutdown(wait=True)
+
+        if getattr(self, 'execute_thread', None):
             with self.terminate_mutex:
                 self.need_to_terminate = True
 
+            # wake up the execute thread so it notices the termination request
+            with self.execute_condition:
+                self.execute_condition.notify()
+
             assert(self.execute_thread)
             self.execute_thread.join()
 
+    # the former plain bool flags, kept for compatibility and backed by the events
+    @property
+    def new_goal(self):
+        return self._new_goal_event.is_set()
+
+    @new_goal.setter
+    def new_goal(self, value):
+        self._set_event(self._new_goal_event, value)
+
+    @property
+    def preempt_request(self):
+        return self._preempt_event.is_set()
+
+    @preempt_request.setter
+    def preempt_request(self, value):
+        self._set_event(self._preempt_event, value)
+
+    @property
+    def new_goal_preempt_request(self):
+        return self._new_goal_preempt_event.is_set()
+
+    @new_goal_preempt_request.setter
+    def new_goal_preempt_request(self, value):
+        self._set_event(self._new_goal_preempt_event, value)
+
+    def _set_event(self, event, value):
+        if value:
+            event.set()
+        else:
+            event.clear()
+
     ## @brief Accepts a new goal when one is available The status of this
     ## goal is set to active upon acceptance, and the status of any
     ## previously active goal is set to preempted. Preempts received for the
@@ -84,8 +159,8 @@ class MultiGoalActionServer:
     ## sure the new goal does not have a pending preempt request.
     ## @return A shared_ptr to the new goal.
     def accept_new_goal(self):
-        with self.action_server.lock, self.lock:
-            if not self.new_goal or not self.next_goal.get_goal():
+        with self._state_lock:
+            if not self._new_goal_event.is_set() or not self.next_goal.get_goal():
                 rospy.logerr("Attempting to accept the next goal when a new goal is not available")
                 return None
 
@@ -97,11 +172,15 @@ class MultiGoalActionServer:
 
             # accept the next goal
             self.current_goal = self.next_goal
-            self.new_goal = False
+            self._current_stamp_ns = self._next_stamp_ns
+            self._new_goal_event.clear()
 
             # set preempt to request to equal the preempt state of the new goal
-            self.preempt_request = self.new_goal_preempt_request
-            self.new_goal_preempt_request = False
+            if self._new_goal_preempt_event.is_set():
+                self._preempt_event.set()
+            else:
+                self._preempt_event.clear()
+            self._new_goal_preempt_event.clear()
 
             # set the status of the current goal to be active
             self.current_goal.set_accepted("This goal has been accepted by the simple action server")
@@ -110,60 +189,77 @@ class MultiGoalActionServer:
             return
 
     def get_next_goal(self):
-        # set the status of the current goal to be active
+        # never pick up a new goal while the current one is still being worked on
+        if self.is_active():
+            return None
 
-        if len(self.execution_queue)>0:
-            self.next_goal = self.execution_queue[0]
-            self.new_goal = True
-            self.new_goal_preempt_request = False
+        # dequeue and accept the next goal in a single critical section, so
+        # internal_goal_callback never sees a next_goal that is still queued
+        with self._state_lock:
+            if self.execution_queue:
+                self.next_goal = self.execution_queue.popleft()
+                self._next_stamp_ns = self.next_goal.get_goal_id().stamp.to_nsec()
+                self._new_goal_event.set()
+                self._new_goal_preempt_event.clear()
 
-            self.accept_new_goal()
+                # set the status of the current goal to be active
+                self.accept_new_goal()
 
-            self.execution_queue.popleft()
-            
-        return self.current_goal.get_goal()
+            return self.current_goal.get_goal()
 
     ## @brief Allows  polling implementations to query about the availability of a new goal
     ## @return True if a new goal is available, false otherwise
     def is_new_goal_available(self):
-        return self.new_goal
+        return self._new_goal_event.is_set()
 
     ## @brief Allows  polling implementations to query about preempt requests
     ## @return True if a preempt is requested, false otherwise
     def is_preempt_requested(self):
-        return self.preempt_request
+        goal = self.current_goal_by_thread.get(threading.current_thread().ident)
+        if goal is not None:
+            return goal.get_goal_id().id in self._preempted_goal_ids
+        return self._preempt_event.is_set()
 
     ## @brief Allows  polling implementations to query about the status of the current goal
     ## @return True if a goal is active, false otherwise
     def is_active(self):
-        if not self.current_goal.get_goal():
+        current_goal = self.get_current_goal()
+        if not current_goal.get_goal():
             return False
 
-        status = self.current_goal.get_goal_status().status
-        return status == GoalStatus.ACTIVE or status == GoalStatus.PREEMPTING
+        return current_goal.get_goal_status().status in _ACTIVE_STATES
+
+    ## @brief Returns the goal pursued by the calling thread, this is the goal executed
+    ## by the calling worker thread in parallel mode and the current goal otherwise
+    def get_current_goal(self):
+        return self.current_goal_by_thread.get(threading.current_thread().ident, self.current_goal)
 
     ## @brief Sets the status of the active goal to succeeded
     ## @param  result An optional result to send back to any clients of the goal
     def set_succeeded(self, result=None, text=""):
-        with self.action_server.lock, self.lock:
+        with self._state_lock:
             if not result:
                 result = self.get_default_result()
-            self.current_goal.set_succeeded(result, text)
+            self.get_current_goal().set_succeeded(result, text)
+            self.execute_condition.notify()
 
     ## @brief Sets the status of the active goal to aborted
     ## @param  result An optional result to send back to any clients of the goal
     def set_aborted(self, result=None, text=""):
-        with self.action_server.lock, self.lock:
+        with self._state_lock:
             if not result:
                 result = self.get_default_result()
-            self.current_goal.set_aborted(result, text)
-            # abort all goals in the execution queue
-            self.reject_all("This goal was rejected and cleared from the execution queue.")
+            self.get_current_goal().set_aborted(result, text)
+            # abort all goals in the execution queue, in parallel mode the queued goals
+            # are independent of the aborted one and are left alone
+            if not self._executor:
+                self.reject_all("This goal was rejected and cleared from the execution queue.")
+            self.execute_condition.notify()
 
     ## @brief Publishes feedback for a given goal
     ## @param  feedback Shared pointer to the feedback to publish
     def publish_feedback(self, feedback):
-        self.current_goal.publish_feedback(feedback)
+        self.get_current_goal().publish_feedback(feedback)
 
     def get_default_result(self):
         return self.action_server.ActionResultType()
@@ -173,29 +269,32 @@ class MultiGoalActionServer:
     def set_preempted(self, result=None, text=""):
         if not result:
             result = self.get_default_result()
-        with self.action_server.lock, self.lock:
+        with self._state_lock:
             rospy.logdebug("Setting the current goal as canceled")
-            self.current_goal.set_canceled(result, text)
-            # cancel all goals in the execution queue
-            self.cancel_all("This goal was rejected and cleared from the execution queue.")
+            self.get_current_goal().set_canceled(result, text)
+            # cancel all goals in the execution queue, in parallel mode the queued goals
+            # are independent of the preempted one and are left alone
+            if not self._executor:
+                self.cancel_all("This goal was rejected and cleared from the execution queue.")
+            self.execute_condition.notify()
 
     ## @brief Sets the status of the all goals to rejected
     ## @param  text An optional text message to send back to any clients of the goal
     def reject_all(self, text=""):
-        with self.action_server.lock, self.lock:
+        with self._state_lock:
             # abort all goals in the execution queue
-            while len(self.execution_queue)>0:
-                self.execution_queue[0].set_rejected(None, text)
-                self.execution_queue.popleft()
+            for goal in self.execution_queue:
+                goal.set_rejected(None, text)
+            self.execution_queue.clear()
 
     ## @brief Sets the status of the all goals to recalled or preempted
     ## @param  text An optional text message to send back to any clients of the goal
     def cancel_all(self, text=""):
-        with self.action_server.lock, self.lock:
+        with self._state_lock:
             # abort all goals in the execution queue
-            while len(self.execution_queue)>0:
-                self.execution_queue[0].set_canceled(None, text)
-                self.execution_queue.popleft()
+            for goal in self.execution_queue:
+                goal.set_canceled(None, text)
+            self.execution_queue.clear()
 
     ## @brief Allows users to register a callback to be invoked when a new goal is available
     ## @param cb The callback to be invoked
@@ -220,89 +319,138 @@ class MultiGoalActionServer:
 
     ## @brief Callback for when the ActionServer receives a new goal and passes it on
     def internal_goal_callback(self, goal):
-        self.execute_condition.acquire()
-
         try:
             rospy.logdebug("A new goal %s has been received by the action server queue.", goal.get_goal_id().id)
 
             # check that the timestamp is past that of the current goal and the next goal
-            if((not self.current_goal.get_goal() or goal.get_goal_id().stamp >= self.current_goal.get_goal_id().stamp)
-               and (not self.next_goal.get_goal() or goal.get_goal_id().stamp >= self.next_goal.get_goal_id().stamp)):
-                # if next_goal has not been accepted already... its going to get bumped, but we need to let the client know we're preempting
-                # rospy.logdebug("Checking if the next goal has been accepted already...")
-                # if(self.next_goal.get_goal() and (not self.current_goal.get_goal() or self.next_goal != self.current_goal)):
-                #     self.next_goal.set_canceled(None, "This goal was canceled because another goal was received by the simple action server")
+            stamp_ns = goal.get_goal_id().stamp.to_nsec()
+            current_stamp_ns = self._current_stamp_ns
+            next_stamp_ns = self._next_stamp_ns
+            if((current_stamp_ns is not None and stamp_ns < current_stamp_ns)
+               or (next_stamp_ns is not None and stamp_ns < next_stamp_ns)):
+                # the goal requested has already been preempted by a different goal, so we're not going to execute it
+                goal.set_canceled(None, "This goal was canceled because another goal was received by the simple action server")
+                return
+
+            with self.execute_condition:
+                # a full deque would silently drop its oldest goal, so reject the new one instead
+                if self.execution_queue.maxlen is not None and len(self.execution_queue) >= self.execution_queue.maxlen:
+                    rospy.logwarn("The execution queue is full, rejecting goal %s", goal.get_goal_id().id)
+                    goal.set_rejected(None, "This goal was rejected because the execution queue of the action server is full")
+                    return
+
+                if self._executor:
+                    # hand the goal to a worker thread, the worker blocks on the lock we
+                    # hold until the goal is queued below
+                    try:
+                        self._executor.submit(self.execute_next_goal)
+                    except RuntimeError:
+                        # the executor has been shut down
+                        goal.set_rejected(None, "This goal was rejected because the action server is shutting down")
+                        return
 
                 rospy.logdebug("Appending new goal to execution queue")
 
                 self.execution_queue.append(goal)
 
-                # Trigger runLoop to call execute()
-                self.execute_condition.notify()
-                self.execute_condition.release()
-            else:
-                # the goal requested has already been preempted by a different goal, so we're not going to execute it
-                goal.set_canceled(None, "This goal was canceled because another goal was received by the simple action server")
-                self.execute_condition.release()
+                if not self._executor:
+                    # Trigger runLoop to call execute()
+                    self.execute_condition.notify()
         except Exception as e:
             rospy.logerr("MultiGoalActionServer.internal_goal_callback - exception %s", str(e))
-            self.execute_condition.release()
 
     ## @brief Callback for when the ActionServer receives a new preempt and passes it on
     def internal_preempt_callback(self, preempt):
-        with self.lock:
-            rospy.logdebug("A preempt has been received by the MultiGoalActionServer")
-
-            # if the preempt is for the current goal, then we'll set the preemptRequest flag and call the user's preempt callback
-            if(preempt == self.current_goal):
-                rospy.logdebug("Setting preempt_request bit for the current goal to TRUE and invoking callback")
-                self.preempt_request = True
-
-                # if the user has registered a preempt callback, we'll call it now
-                if(self.preempt_callback):
-                    self.preempt_callback()
-            # if the preempt applies to the next goal, we'll set the preempt bit for that
-            elif(preempt == self.next_goal):
-                rospy.logdebug("Setting preempt request bit for the next goal to TRUE")
-                self.new_goal_preempt_request = True
+        # the ActionServer invokes this callback while already holding self._state_lock
+        rospy.logdebug("A preempt has been received by the MultiGoalActionServer")
+
+        # if the preempt is for a goal executed by a worker thread, we'll flag that goal and call the user's preempt callback
+        if(preempt in self.current_goal_by_thread.values()):
+            rospy.logdebug("Setting preempt_request bit for goal %s and invoking callback", preempt.get_goal_id().id)
+            self._preempted_goal_ids.add(preempt.get_goal_id().id)
+
+            if(self.preempt_callback):
+                self.preempt_callback()
+        # if the preempt is for the current goal, then we'll set the preemptRequest flag and call the user's preempt callback
+        elif(preempt == self.current_goal):
+            rospy.logdebug("Setting preempt_request bit for the current goal to TRUE and invoking callback")
+            self._preempt_event.set()
+
+            # if the user has registered a preempt callback, we'll call it now
+            if(self.preempt_callback):
+                self.preempt_callback()
+        # if the preempt applies to the next goal, we'll set the preempt bit for that
+        elif(preempt == self.next_goal):
+            rospy.logdebug("Setting preempt request bit for the next goal to TRUE")
+            self._new_goal_preempt_event.set()
 
     ## @brief Called from a separate thread to call blocking execute calls
     def executeLoop(self):
-        loop_duration = rospy.Duration.from_sec(.1)
+        # look these up once, the loop runs for the lifetime of the server
+        is_shutdown = rospy.is_shutdown
+        wait_secs = 1.0
+        execute_condition = self.execute_condition
+        execute_callback = self.execute_callback
+        get_next_goal = self.get_next_goal
+        is_active = self.is_active
+        run_execute_callback = self.run_execute_callback
+
+        while (not is_shutdown()):
+            # sleep until a goal can be picked up or we are asked to terminate; the
+            # timeout only serves to notice a rospy shutdown, which cannot notify us
+            with execute_condition:
+                while ((not self.execution_queue or is_active()) and not self.need_to_terminate
+                       and not is_shutdown()):
+                    execute_condition.wait(wait_secs)
 
-        while (not rospy.is_shutdown()):
             with self.terminate_mutex:
                 if (self.need_to_terminate):
                     break
 
-            # the following checks (is_active) are performed without locking
-            # this checks if the action server is done with the current goal
-            while (not rospy.is_shutdown()):
-                if not (self.is_active()):
-                    break
-
-            # if (self.is_new_goal_available()):
-                # accept_new_goal() is performing its own locking
-                # self.accept_new_goal()
-            goal = self.get_next_goal()
+            goal = get_next_goal()
 
-            if self.is_active():
-                if not self.execute_callback:
+            if goal is not None and is_active():
+                if not execute_callback:
                     rospy.logerr("execute_callback_ must exist. This is a bug in MultiGoalActionServer")
                     return
 
-                try:
-                    self.execute_callback(goal)
+                run_execute_callback(goal)
 
-                    if self.is_active():
-                        rospy.logwarn("Your executeCallback did not set the goal to a terminal status.  " +
-                                      "This is a bug in your ActionServer implementation. Fix your code!  " +
-                                      "For now, the ActionServer will set this goal to aborted")
-                        self.set_aborted(None, "No terminal state was set.")
-                except Exception as ex:
-                    rospy.logerr("Exception in your execute callback: %s\n%s", str(ex),
-                                    traceback.format_exc())
-                    self.set_aborted(None, "Exception in execute callback: %s" % str(ex))
+    ## @brief Called from a worker thread in parallel mode to execute the oldest queued goal
+    def execute_next_goal(self):
+        with self._state_lock:
+            # the queue may have been cleared by reject_all/cancel_all in the meantime
+            if not self.execution_queue:
+                return
+            goal = self.execution_queue.popleft()
 
-            with self.execute_condition:
-                self.execute_condition.wait(loop_duration.to_sec())
\ No newline at end of file
+            rospy.logdebug("Accepting goal %s in worker thread", goal.get_goal_id().id)
+            ident = threading.current_thread().ident
+            self.current_goal_by_thread[ident] = goal
+            goal.set_accepted("This goal has been accepted by the multi goal action server")
+
+            # a cancel request received while the goal was queued turns it into PREEMPTING on acceptance
+            if goal.get_goal_status().status == GoalStatus.PREEMPTING:
+                self._preempted_goal_ids.add(goal.get_goal_id().id)
+
+        try:
+            self.run_execute_callback(goal.get_goal())
+        finally:
+            with self._state_lock:
+                del self.current_goal_by_thread[ident]
+                self._preempted_goal_ids.discard(goal.get_goal_id().id)
+
+    ## @brief Runs the execute callback for a goal and makes sure the goal ends up in a terminal state
+    def run_execute_callback(self, goal):
+        try:
+            self.execute_callback(goal)
+
+            if self.is_active():
+                rospy.logwarn("Your executeCallback did not set the goal to a terminal status.  " +
+                              "This is a bug in your ActionServer implementation. Fix your code!  " +
+                              "For now, the ActionServer will set this goal to aborted")
+                self.set_aborted(None, "No terminal state was set.")
+        except Exception as ex:
+            rospy.logerr("Exception in your execute callback: %s\n%s", str(ex),
+                            traceback.format_exc())
+            self.set_aborted(None, "Exception in execute callback: %s" % str(ex))
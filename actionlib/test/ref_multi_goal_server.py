@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+PKG = 'actionlib'
+import threading
+
+import rospy
+
+from actionlib.multi_goal_action_server import MultiGoalActionServer
+from actionlib.msg import TestAction, TestResult
+
+
+class RefMultiGoalServer (MultiGoalActionServer):
+
+    def __init__(self, name, **kwargs):
+        self.running_lock = threading.Lock()
+        self.running = 0
+
+        action_spec = TestAction
+        MultiGoalActionServer.__init__(
+            self, name, action_spec, self.execute_callback_impl, False, **kwargs)
+        self.start()
+        rospy.loginfo("Creating MultiGoalActionServer [%s]\n", name)
+
+    def execute_callback_impl(self, goal):
+        rospy.loginfo("Got goal %d", int(goal.goal))
+        if goal.goal == 1:
+            self.set_succeeded(None, "The ref server has succeeded")
+        elif goal.goal == 2:
+            self.set_aborted(None, "The ref server has aborted")
+        elif goal.goal == 10:
+            # report how many goals were executing at the same time as this one
+            with self.running_lock:
+                self.running += 1
+            rospy.sleep(1.0)
+            with self.running_lock:
+                running = self.running
+                self.running -= 1
+            self.set_succeeded(TestResult(running), "The ref server has succeeded")
+        elif goal.goal == 11:
+            # keep the server busy while goals pile up in the queue
+            rospy.sleep(3.0)
+            self.set_succeeded(None, "The ref server has succeeded")
+        elif goal.goal == 20:
+            # wait for a preempt of this goal only
+            deadline = rospy.Time.now() + rospy.Duration(3.0)
+            while rospy.Time.now() < deadline:
+                if self.is_preempt_requested():
+                    self.set_preempted(TestResult(20), "The ref server has been preempted")
+                    return
+                rospy.sleep(0.05)
+            self.set_succeeded(None, "The ref server has not been preempted")
+        else:
+            pass
+
+
+if __name__ == "__main__":
+    rospy.init_node("ref_multi_goal_server")
+    ref_server = RefMultiGoalServer("reference_multi_goal_action", max_parallel_goals=3)
+    serial_server = RefMultiGoalServer("reference_serial_multi_goal_action")
+    bounded_server = RefMultiGoalServer("reference_bounded_multi_goal_action", max_queue_size=1)
+    unbounded_server = RefMultiGoalServer("reference_unbounded_multi_goal_action", max_queue_size=None)
+
+    rospy.spin()
@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+PKG = 'actionlib'
+
+import unittest
+import rospy
+from actionlib_msgs.msg import GoalStatus
+from actionlib import MultiGoalActionClient
+from actionlib.msg import TestAction, TestGoal
+
+
+class TestMultiGoalActionClient(unittest.TestCase):
+
+    def make_client(self):
+        client = MultiGoalActionClient('reference_multi_goal_action', TestAction)
+        client.wait_for_server()
+        return client
+
+    def test_send_and_get_result(self):
+        client = self.make_client()
+        self.assertEqual(0, client.get_num_goals())
+        self.assertRaises(IndexError, client.get_goal_state)
+
+        for i in range(3):
+            client.send_goal(TestGoal(1))
+        self.assertEqual(3, client.get_num_goals())
+
+        self.assertTrue(client.wait_for_result(), "Goal didn't finish")
+        self.assertEqual(GoalStatus.SUCCEEDED, client.get_goal_state())
+
+        # getting the result releases the client of the latest goal
+        latest = list(client.action_clients.values())[-1]
+        client.get_result()
+        self.assertEqual(2, client.get_num_goals())
+        self.assertTrue(latest not in client.action_clients.values())
+
+    def test_cancel_all_goals(self):
+        client = self.make_client()
+
+        for i in range(2):
+            client.send_goal(TestGoal(20))
+        rospy.sleep(0.5)
+
+        client.cancel_all_goals()
+
+        for action_client in list(client.action_clients.values()):
+            self.assertTrue(action_client.wait_for_result(rospy.Duration(10.0)),
+                         "Goal didn't finish")
+            self.assertEqual(GoalStatus.PREEMPTED, action_client.get_state())
+
+
+if __name__ == '__main__':
+    import rostest
+    rospy.init_node('test_multi_goal_action_client')
+    rostest.rosrun('actionlib', 'test_multi_goal_action_client', TestMultiGoalActionClient)
@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+PKG = 'actionlib'
+
+import unittest
+import rospy
+from actionlib_msgs.msg import GoalStatus
+from actionlib import SimpleActionClient
+from actionlib import ActionClient
+from actionlib.action_client import CommState
+from actionlib.msg import TestAction, TestGoal
+
+
+class TestRefMultiGoalActionServer(unittest.TestCase):
+
+    def make_client(self):
+        client = SimpleActionClient('reference_multi_goal_action', TestAction)
+        self.assertTrue(client.wait_for_server(rospy.Duration(2.0)),
+                     'Could not connect to the action server')
+        return client
+
+    def make_action_client(self, name):
+        client = ActionClient(name, TestAction)
+        self.assertTrue(client.wait_for_server(rospy.Duration(2.0)),
+                     'Could not connect to the action server')
+        return client
+
+    def wait_for_done(self, handles, timeout):
+        timeout_time = rospy.Time.now() + rospy.Duration(timeout)
+        while rospy.Time.now() < timeout_time:
+            if all(gh.get_comm_state() == CommState.DONE for gh in handles):
+                return True
+            rospy.sleep(0.05)
+        return False
+
+    def test_serial_dispatches_queued_goal(self):
+        client = self.make_action_client('reference_serial_multi_goal_action')
+
+        done_times = {}
+
+        def on_transition(name, gh):
+            if gh.get_comm_state() == CommState.DONE and name not in done_times:
+                done_times[name] = rospy.Time.now()
+
+        slow = client.send_goal(TestGoal(10), transition_cb=lambda gh: on_transition('slow', gh))
+        queued = client.send_goal(TestGoal(1), transition_cb=lambda gh: on_transition('queued', gh))
+
+        self.assertTrue(self.wait_for_done([slow, queued], 10.0), "Goals didn't finish")
+        self.assertEqual(GoalStatus.SUCCEEDED, slow.get_goal_status())
+        self.assertEqual(GoalStatus.SUCCEEDED, queued.get_goal_status())
+
+        # the serial server executes one goal at a time
+        self.assertEqual(1, slow.get_result().result)
+
+        # the queued goal is picked up as soon as the previous one is done
+        self.assertTrue(done_times['queued'] - done_times['slow'] < rospy.Duration(0.5),
+                     "Queued goal was not dispatched right after the previous one")
+
+    def test_serial_abort_rejects_queue(self):
+        client = self.make_action_client('reference_serial_multi_goal_action')
+
+        slow = client.send_goal(TestGoal(10))
+        aborted = client.send_goal(TestGoal(2))
+        queued = [client.send_goal(TestGoal(1)) for i in range(2)]
+
+        self.assertTrue(self.wait_for_done([slow, aborted] + queued, 10.0), "Goals didn't finish")
+        self.assertEqual(GoalStatus.SUCCEEDED, slow.get_goal_status())
+        self.assertEqual(GoalStatus.ABORTED, aborted.get_goal_status())
+        for gh in queued:
+            self.assertEqual(GoalStatus.REJECTED, gh.get_goal_status())
+
+    def test_full_queue_rejects_goal(self):
+        client = self.make_action_client('reference_bounded_multi_goal_action')
+
+        slow = client.send_goal(TestGoal(10))
+        # let the slow goal leave the queue so the next one fills it
+        rospy.sleep(0.3)
+        queued = client.send_goal(TestGoal(1))
+        rospy.sleep(0.1)
+        overflow = client.send_goal(TestGoal(1))
+
+        self.assertTrue(self.wait_for_done([slow, queued, overflow], 10.0), "Goals didn't finish")
+        self.assertEqual(GoalStatus.SUCCEEDED, slow.get_goal_status())
+        self.assertEqual(GoalStatus.SUCCEEDED, queued.get_goal_status())
+        self.assertEqual(GoalStatus.REJECTED, overflow.get_goal_status())
+
+    def test_unbounded_queue_keeps_all_goals(self):
+        client = self.make_action_client('reference_unbounded_multi_goal_action')
+
+        slow = client.send_goal(TestGoal(11))
+        # more goals than the default max_queue_size of 64, paced so the client publisher
+        # does not drop any, all arriving while the slow goal is still running
+        queued = []
+        for i in range(70):
+            queued.append(client.send_goal(TestGoal(1)))
+            rospy.sleep(0.02)
+
+        # result messages can be dropped from the publisher queue in a burst,
+        # so wait on the goal status reported in the latched status array
+        handles = [slow] + queued
+        timeout_time = rospy.Time.now() + rospy.Duration(20.0)
+        while rospy.Time.now() < timeout_time:
+            if all(gh.get_goal_status() == GoalStatus.SUCCEEDED for gh in handles):
+                break
+            rospy.sleep(0.05)
+        for gh in handles:
+            self.assertEqual(GoalStatus.SUCCEEDED, gh.get_goal_status())
+
+    def test_parallel_execution(self):
+        clients = [self.make_client() for i in range(3)]
+        for client in clients:
+            client.send_goal(TestGoal(10))
+
+        for client in clients:
+            self.assertTrue(client.wait_for_result(rospy.Duration(10.0)),
+                         "Goal didn't finish")
+            self.assertEqual(GoalStatus.SUCCEEDED, client.get_state())
+
+        # every goal reports how many goals were running alongside it
+        self.assertTrue(max(client.get_result().result for client in clients) > 1,
+                     "Goals were not executed in parallel")
+
+    def test_preempt_is_per_goal(self):
+        preempted = self.make_client()
+        other = self.make_client()
+        preempted.send_goal(TestGoal(20))
+        other.send_goal(TestGoal(20))
+
+        rospy.sleep(0.5)
+        preempted.cancel_goal()
+
+        self.assertTrue(preempted.wait_for_result(rospy.Duration(10.0)),
+                     "Goal didn't finish")
+        self.assertEqual(GoalStatus.PREEMPTED, preempted.get_state())
+
+        self.assertTrue(other.wait_for_result(rospy.Duration(10.0)),
+                     "Goal didn't finish")
+        self.assertEqual(GoalStatus.SUCCEEDED, other.get_state())
+
+    def test_abort_keeps_queued_goals(self):
+        # keep all workers busy so the following goals wait in the queue
+        busy = [self.make_client() for i in range(3)]
+        for client in busy:
+            client.send_goal(TestGoal(10))
+
+        aborted = self.make_client()
+        aborted.send_goal(TestGoal(2))
+
+        queued = [self.make_client() for i in range(2)]
+        for client in queued:
+            client.send_goal(TestGoal(1))
+
+        self.assertTrue(aborted.wait_for_result(rospy.Duration(10.0)),
+                     "Goal didn't finish")
+        self.assertEqual(GoalStatus.ABORTED, aborted.get_state())
+
+        for client in busy + queued:
+            self.assertTrue(client.wait_for_result(rospy.Duration(10.0)),
+                         "Goal didn't finish")
+            self.assertEqual(GoalStatus.SUCCEEDED, client.get_state())
+
+
+if __name__ == '__main__':
+    import rostest
+    rospy.init_node('test_ref_multi_goal_action_server')
+    rostest.rosrun('actionlib', 'test_multi_goal_python_server', TestRefMultiGoalActionServer)